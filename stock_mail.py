@@ -1,9 +1,11 @@
 import os
 import requests
+import numpy as np
 import pandas as pd
 import datetime
-import io
 import smtplib
+import string
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
@@ -16,85 +18,16 @@ raw_subscribers = os.environ.get('SUBSCRIBERS', SENDER_EMAIL)
 # 將字串轉換為 Python 清單 (List)
 RECEIVER_EMAILS = [email.strip() for email in raw_subscribers.split(',')]
 
-def get_stock_data():
-    """使用證交所 Open Data CSV"""
-    url = "https://www.twse.com.tw/exchangeReport/STOCK_DAY_ALL?response=open_data"
-    headers = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"}
-    try:
-        response = requests.get(url, headers=headers, timeout=15)
-        # 清洗可能存在的特殊空白字元
-        clean_text = response.text.replace('\xa0', ' ')
-        df = pd.read_csv(io.StringIO(clean_text))
-        return df, "OK"
-    except Exception as e:
-        return None, str(e)
+# --- 共用 HTTP 連線 (keep-alive + 自動重試，避免每次請求重新握手) ---
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"})
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=4, pool_maxsize=4,
+    max_retries=requests.adapters.Retry(total=3, backoff_factor=0.3))
+_SESSION.mount('https://', _adapter)
 
-def send_email_report(html_content, date_str):
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        # 這裡會使用您 Secrets 裡的 MY_EMAIL 和 MY_PASSWORD
-        server.login(SENDER_EMAIL, APP_PASSWORD)
-        
-        for receiver in RECEIVER_EMAILS:
-            msg = MIMEMultipart()
-            msg['From'] = SENDER_EMAIL
-            msg['To'] = receiver
-            msg['Subject'] = f"📊 台股強勢股日報 - {date_str}"
-            msg.attach(MIMEText(html_content, 'html', 'utf-8'))
-            
-            server.send_message(msg)
-            print(f"✅ 成功寄送給: {receiver}")
-            
-        server.quit()
-    except Exception as e:
-        print(f"❌ 郵件發送失敗: {e}")
-
-def process_and_mail():
-    df, status = get_stock_data()
-    if df is None or df.empty:
-        print(f"❌ 無法取得資料: {status}")
-        return
-
-    try:
-        # 1. 資料清洗
-        cols = ['成交金額', '收盤價', '漲跌價差']
-        for col in cols:
-            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', ''), errors='coerce')
-        
-        df['昨收'] = df['收盤價'] - df['漲跌價差']
-        df['漲幅'] = (df['漲跌價差'] / df['昨收']) * 100
-        df['成交額(億)'] = (df['成交金額'] / 100000000).round(1)
-        df['漲幅'] = df['漲幅'].round(2)
-
-        # 2. 核心篩選（漲幅需 > 2.5%）
-        filtered_df = df[df['漲幅'] > 2.5].copy()
-
-        # 3. 定義格式化函數
-        def create_link(row):
-            code = str(row['證券代號']).strip()
-            name = row['證券名稱']
-            return f'<a href="https://tw.stock.yahoo.com/quote/{code}" style="text-decoration:none; color:#0066cc; font-weight:bold;">{name}</a>'
-
-        def format_change_color(val):
-            color = "#FF0000" if val > 5.0 else "#D20000"
-            weight = "bold" if val > 5.0 else "normal"
-            return f'<span style="color: {color}; font-weight: {weight};">{val:.2f}%</span>'
-
-        # 4. 準備兩種排序的 HTML 表格 (各取前 20 檔)
-        def generate_styled_table(data_df, sort_by):
-            temp_df = data_df.sort_values(by=sort_by, ascending=False).head(20).copy()
-            # 轉換顯示格式
-            temp_df['證券名稱'] = temp_df.apply(create_link, axis=1)
-            temp_df['漲幅'] = temp_df['漲幅'].apply(format_change_color)
-            return temp_df[['證券代號', '證券名稱', '收盤價', '漲幅', '成交額(億)']].to_html(index=False, escape=False)
-
-        # 產生兩個看板
-        table_volume = generate_styled_table(filtered_df, '成交金額')
-        table_gain = generate_styled_table(filtered_df, '漲幅')
-
-        # 5. HTML 樣式與組合
-        html_style = """
+# --- 靜態 HTML 骨架（每次執行只替換日期與兩張表格，不重組多 KB 字串） ---
+_HTML_STYLE = """
         <style>
             table { border-collapse: collapse; width: 100%; font-family: "Microsoft JhengHei", sans-serif; margin-bottom: 30px; }
             th { background-color: #4CAF50; color: white; padding: 12px; text-align: left; position: sticky; top: 0; }
@@ -104,33 +37,133 @@ def process_and_mail():
             h3 { color: #2c3e50; border-left: 6px solid #4CAF50; padding-left: 12px; margin-top: 40px; }
         </style>
         """
-        
-        full_html = f"""
+
+_HTML_TEMPLATE = string.Template("""
         <html>
-        <head>{html_style}</head>
+        <head>""" + _HTML_STYLE + """</head>
         <body>
             <h2 style="color: #2c3e50;">📈 台股盤後強勢股篩選報告</h2>
-            <p>報告日期：{datetime.datetime.now().strftime('%Y-%m-%d')}</p>
+            <p>報告日期：${date}</p>
             <p style="color: #666;">篩選條件：漲幅 > 2.5%</p>
             <hr>
-            
-            <h3>🔥 資金焦點：成交額 Top 20</h3>
+
+            <h3>🔥 資金焦點：成交額 Top ${top_k}</h3>
             <p style="font-size: 14px; color: #888;">此表依成交金額排序，反映市場大資金流向。</p>
-            {table_volume}
-            
-            <h3>🚀 漲幅先鋒：漲幅 Top 20</h3>
+            ${table_volume}
+
+            <h3>🚀 漲幅先鋒：漲幅 Top ${top_k}</h3>
             <p style="font-size: 14px; color: #888;">此表依漲幅排序，反映當前盤勢最強勁的個股。</p>
-            {table_gain}
-            
+            ${table_gain}
+
             <br>
             <p style="color: gray; font-size: 12px; margin-top: 20px;">註：點擊證券名稱可查看 Yahoo 股市技術線圖。資料來源：證交所 Open Data。</p>
         </body>
         </html>
-        """
+        """)
+
+def get_stock_data():
+    """使用證交所 Open Data CSV"""
+    url = "https://www.twse.com.tw/exchangeReport/STOCK_DAY_ALL?response=open_data"
+    try:
+        # 串流回應直接餵給 pandas 的 C 解析器，全程只留一份資料在記憶體
+        # thousands=',' 讓 C tokenizer 一次完成去逗號 + 轉 float
+        with _SESSION.get(url, stream=True, timeout=15) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            df = pd.read_csv(response.raw, encoding='utf-8',
+                             thousands=',',
+                             dtype={'證券代號': 'category', '證券名稱': 'string',
+                                    '收盤價': 'float32', '漲跌價差': 'float32',
+                                    '成交金額': 'float64'},
+                             na_values=['', '\xa0', ' ', '--'])
+        return df, "OK"
+    except Exception as e:
+        return None, str(e)
+
+def send_email_report(html_content, date_str):
+    try:
+        # SMTP_SSL 直連 465，少一次 STARTTLS 升級；連線在 with 區塊內跨收件人重用
+        with smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=15) as server:
+            # 這裡會使用您 Secrets 裡的 MY_EMAIL 和 MY_PASSWORD
+            server.login(SENDER_EMAIL, APP_PASSWORD)
+
+            for receiver in RECEIVER_EMAILS:
+                msg = MIMEMultipart()
+                msg['From'] = SENDER_EMAIL
+                msg['To'] = receiver
+                msg['Subject'] = f"📊 台股強勢股日報 - {date_str}"
+                msg.attach(MIMEText(html_content, 'html', 'utf-8'))
 
-        send_email_report(full_html, datetime.datetime.now().strftime('%Y-%m-%d'))
+                server.send_message(msg)
+                print(f"✅ 成功寄送給: {receiver}")
+    except Exception as e:
+        print(f"❌ 郵件發送失敗: {e}")
+
+def generate_report(date_str, top_k=20):
+    """抓取當日行情並組出完整 HTML 報告；失敗時回傳 None"""
+    df, status = get_stock_data()
+    if df is None or df.empty:
+        print(f"❌ 無法取得資料: {status}")
+        return None
+
+    try:
+        # 1. 衍生欄位（數值清洗已在 read_csv 階段完成）
+        # 昨收 <= 0 的邊角案例（如前日跌停、無昨收）會讓漲幅變成 inf，直接標成 NaN
+        prev = df['收盤價'].to_numpy() - df['漲跌價差'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chg = np.where(prev > 0, df['漲跌價差'].to_numpy() / prev * 100.0, np.nan)
+        df['昨收'] = prev
+        df['漲幅'] = np.round(chg, 2)
+        df['成交額(億)'] = (df['成交金額'].to_numpy() * 1e-8).round(1)
+
+        # 2. 核心篩選（漲幅需 > 2.5%）— 只複製後續會用到的欄位
+        filtered_df = df.loc[df['漲幅'] > 2.5,
+                             ['證券代號', '證券名稱', '收盤價', '漲幅', '成交金額', '成交額(億)']].copy()
+
+        # 3. 顯示格式只算一次，各排序看板共用（向量化字串運算，避免逐列 apply）
+        code = filtered_df['證券代號'].astype(str).str.strip()
+        name = filtered_df['證券名稱'].astype(str)
+        filtered_df['證券名稱'] = ('<a href="https://tw.stock.yahoo.com/quote/' + code
+                                 + '" style="text-decoration:none; color:#0066cc; font-weight:bold;">'
+                                 + name + '</a>')
+        strong = filtered_df['漲幅'] > 5.0
+        color = np.where(strong, '#FF0000', '#D20000')
+        weight = np.where(strong, 'bold', 'normal')
+        filtered_df['漲幅_html'] = ('<span style="color: ' + pd.Series(color, index=filtered_df.index)
+                                   + '; font-weight: ' + pd.Series(weight, index=filtered_df.index)
+                                   + ';">' + filtered_df['漲幅'].map('{:.2f}%'.format) + '</span>')
+
+        # 4. 準備兩種排序的 HTML 表格 (各取前 top_k 檔)
+        # 固定五欄、列數不多，直接用 itertuples 組字串比 to_html 的通用格式器快得多
+        header = ''.join(f'<th>{col}</th>' for col in ['證券代號', '證券名稱', '收盤價', '漲幅', '成交額(億)'])
+
+        def generate_styled_table(data_df, sort_by):
+            temp_df = data_df.nlargest(top_k, sort_by)
+            rows = '\n'.join(
+                f'<tr><td>{code}</td><td>{name}</td><td>{close}</td><td>{chg}</td><td>{amt}</td></tr>'
+                for code, name, close, chg, amt in temp_df[
+                    ['證券代號', '證券名稱', '收盤價', '漲幅_html', '成交額(億)']].itertuples(index=False, name=None))
+            return f'<table><thead><tr>{header}</tr></thead>\n<tbody>\n{rows}\n</tbody></table>'
+
+        # 產生兩個看板（兩條 sort→組表管線互相獨立，pandas 的 C 路徑會釋放 GIL）
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            table_volume, table_gain = ex.map(
+                lambda key: generate_styled_table(filtered_df, key),
+                ['成交金額', '漲幅'])
+
+        # 5. 套用靜態骨架，只替換動態內容
+        return _HTML_TEMPLATE.substitute(
+            date=date_str, top_k=top_k,
+            table_volume=table_volume, table_gain=table_gain)
     except Exception as e:
         print(f"❌ 資料處理發生錯誤: {e}")
-        
+        return None
+
+def process_and_mail():
+    today_str = datetime.date.today().isoformat()
+    full_html = generate_report(today_str)
+    if full_html is not None:
+        send_email_report(full_html, today_str)
+
 if __name__ == "__main__":
     process_and_mail()